@@ -13,11 +13,21 @@ Usage:
 import argparse
 import subprocess
 import numpy as np
-from scipy.signal import butter, sosfilt
+from scipy.signal import butter
+from numba import njit
 import time
 import re
 import sys
 import os
+import shutil
+from collections import deque
+
+try:
+    import alsaaudio  # optional: in-process mixer access instead of forking amixer
+    _MIXER_ERRORS = (alsaaudio.ALSAAudioError,)
+except ImportError:
+    alsaaudio = None
+    _MIXER_ERRORS = ()
 
 # ---------------------- Default Configuration ----------------------
 
@@ -25,6 +35,7 @@ MICROPHONE_NAME = "Line In 1 Gain"
 MIN_GAIN_DB = 30
 MAX_GAIN_DB = 38
 GAIN_STEP_DB = 3
+GAIN_RESYNC_CYCLES = 30  # re-read the mixer every N cycles even if our cache looks fine
 
 # RMS thresholds
 NOISE_THRESHOLD_HIGH = 0.01
@@ -32,7 +43,9 @@ NOISE_THRESHOLD_LOW  = 0.001
 
 # No-signal detection
 NO_SIGNAL_THRESHOLD = 1e-6
-NO_SIGNAL_COUNT_THRESHOLD = 3
+# Consecutive silent SLEEP_SECONDS windows before NO_SIGNAL_ACTION (~50 s,
+# no shorter than the ~45 s of the old capture+sleep cycle)
+NO_SIGNAL_COUNT_THRESHOLD = 5
 NO_SIGNAL_ACTION = "scarlett2 reboot && sudo reboot"
 
 SAMPLING_RATE = 48000  # 48 kHz
@@ -40,7 +53,8 @@ LOWCUT        = 2000
 HIGHCUT       = 8000
 FILTER_ORDER  = 4
 RTSP_URL      = "rtsp://192.168.178.124:8554/birdmic"
-SLEEP_SECONDS = 10
+CAPTURE_SECONDS = 5   # test-mode window
+SLEEP_SECONDS = 10    # control-loop window; reading it paces the loop
 
 REFERENCE_PRESSURE = 20e-6  # 20 µPa
 
@@ -57,6 +71,21 @@ def_full_scale = (
     10 ** (DEFAULT_SENSITIVITY / 20)
 )
 
+# Gain readout in `amixer sget` output, matched on the raw bytes
+_GAIN_RE = re.compile(rb'\[(-?\d+(?:\.\d+)?)dB\]')
+
+# alsaaudio mixer handles per control name; None means fall back to amixer
+_mixers = {}
+
+# Last gain written by set_gain_db; None forces a re-read from the mixer
+_current_gain_db = None
+
+# Reused PCM capture buffer (mono s16le)
+_PCM_BUF = bytearray(SAMPLING_RATE * max(CAPTURE_SECONDS, SLEEP_SECONDS) * 2)
+
+# Bandpass design only depends on the constants above, so do it once
+_BANDPASS_SOS = butter(FILTER_ORDER, [LOWCUT, HIGHCUT], btype='band', fs=SAMPLING_RATE, output='sos')
+
 # ---------------------- Argument Parsing ----------------------
 
 def parse_args():
@@ -73,12 +102,36 @@ def debug_print(msg, level="info"):
     current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
     print(f"[{current_time}] [{level.upper()}] {msg}")
 
+def _get_mixer(mic_name):
+    if alsaaudio is None:
+        return None
+    if mic_name not in _mixers:
+        try:
+            _mixers[mic_name] = alsaaudio.Mixer(mic_name)
+        except alsaaudio.ALSAAudioError as e:
+            debug_print(f"alsaaudio cannot open '{mic_name}', using amixer: {e}", "warning")
+            _mixers[mic_name] = None
+    return _mixers[mic_name]
+
 def get_gain_db(mic_name):
+    mixer = _get_mixer(mic_name)
+    if mixer is not None:
+        # Without pcmtype, pyalsaaudio reads the playback or capture side the
+        # control actually has
+        try:
+            volumes = mixer.getvolume(units=alsaaudio.VOLUME_UNITS_DB)
+        except alsaaudio.ALSAAudioError as e:
+            debug_print(f"alsaaudio getvolume failed: {e}", "error")
+            return None
+        if not volumes:
+            debug_print(f"alsaaudio reported no volume channels for '{mic_name}'", "error")
+            return None
+        return volumes[0] / 100.0
     try:
         output = subprocess.check_output(
             ['amixer', 'sget', mic_name], stderr=subprocess.STDOUT
-        ).decode()
-        match = re.search(r'\[(-?\d+(\.\d+)?)dB\]', output)
+        )
+        match = _GAIN_RE.search(output)
         if match:
             return float(match.group(1))
     except subprocess.CalledProcessError as e:
@@ -86,48 +139,114 @@ def get_gain_db(mic_name):
     return None
 
 def set_gain_db(mic_name, gain_db):
+    global _current_gain_db
     gain_db = max(min(gain_db, MAX_GAIN_DB), MIN_GAIN_DB)
+    mixer = _get_mixer(mic_name)
     try:
-        subprocess.check_call(
-            ['amixer', 'sset', mic_name, f'{int(gain_db)}dB'],
-            stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT
-        )
+        if mixer is not None:
+            mixer.setvolume(int(gain_db) * 100, units=alsaaudio.VOLUME_UNITS_DB)
+        else:
+            subprocess.check_call(
+                ['amixer', 'sset', mic_name, f'{int(gain_db)}dB'],
+                stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT
+            )
         debug_print(f"Gain set to: {gain_db} dB", "info")
+        _current_gain_db = float(int(gain_db))
         return True
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, *_MIXER_ERRORS) as e:
         debug_print(f"Failed to set gain: {e}", "error")
+    _current_gain_db = None
     return False
 
-def capture_audio(rtsp_url, duration=5):
+def refresh_gain_db(mic_name):
+    global _current_gain_db
+    _current_gain_db = get_gain_db(mic_name)
+    return _current_gain_db
+
+def start_ffmpeg(rtsp_url):
     cmd = [
-        'ffmpeg', '-loglevel', 'error', '-rtsp_transport', 'tcp',
+        'ffmpeg', '-loglevel', 'error', '-fflags', 'nobuffer', '-flags', 'low_delay',
+        '-probesize', '32', '-analyzeduration', '0', '-rtsp_transport', 'tcp',
         '-i', rtsp_url, '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
-        '-ar', str(SAMPLING_RATE), '-ac', '1', '-t', str(duration), '-'
+        '-ar', str(SAMPLING_RATE), '-ac', '1', '-'
     ]
     try:
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate()
-        if process.returncode != 0:
-            debug_print(f"ffmpeg failed: {stderr.decode().strip()}", "error")
-            return None
-        return np.frombuffer(stdout, dtype=np.int16).astype(np.float32) / 32768.0
-    except Exception as e:
-        debug_print(f"Audio capture exception: {e}", "error")
+        return subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=0)
+    except OSError as e:
+        debug_print(f"Failed to start ffmpeg: {e}", "error")
         return None
 
-def bandpass_filter(audio, lowcut, highcut, fs, order=4):
-    sos = butter(order, [lowcut, highcut], btype='band', fs=fs, output='sos')
-    return sosfilt(sos, audio)
-
-def measure_rms(audio):
-    return float(np.sqrt(np.mean(audio**2))) if len(audio) > 0 else 0.0
+def stop_ffmpeg(proc):
+    if proc is None:
+        return
+    # Close our end first: a child blocked writing to a full pipe gets EPIPE
+    # and exits instead of sitting out the terminate() timeout
+    proc.stdout.close()
+    if proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+def read_chunk(proc, nbytes):
+    # Fill the reused PCM buffer from the running ffmpeg; None if the stream ended
+    mv = memoryview(_PCM_BUF)[:nbytes]
+    off = 0
+    try:
+        while off < nbytes:
+            n = proc.stdout.readinto(mv[off:])
+            if not n:
+                break
+            off += n
+    except OSError as e:
+        debug_print(f"Audio read exception: {e}", "error")
+        return None
+    if off < nbytes:
+        debug_print("ffmpeg stream ended unexpectedly", "error")
+        return None
+    return np.frombuffer(_PCM_BUF, dtype=np.int16, count=nbytes // 2)
+
+@njit(cache=True, fastmath=True)
+def _filter_rms_from_int16(buf_i16, sos):
+    # Single pass over the raw PCM: filter and accumulate the RMS without
+    # materialising any intermediate array. Works in int16 sample units: the
+    # filter is linear, so the 1/32768 full-scale factor is applied once at the end.
+    n_samples = buf_i16.shape[0]
+    if n_samples == 0:
+        return 0.0
+    n_sections = sos.shape[0]
+    z = np.zeros((n_sections, 2))
+    ssum = 0.0
+    for n in range(n_samples):
+        yn = float(buf_i16[n])
+        for s in range(n_sections):
+            xn = yn
+            yn = sos[s, 0] * xn + z[s, 0]
+            z[s, 0] = sos[s, 1] * xn - sos[s, 4] * yn + z[s, 1]
+            z[s, 1] = sos[s, 2] * xn - sos[s, 5] * yn
+        ssum += yn * yn
+    return np.sqrt(ssum / n_samples) * (1.0 / 32768.0)
+
+def measure_band_rms(pcm):
+    # Shared by test mode and the controller so the graph shows exactly what
+    # the thresholds are compared against
+    return float(_filter_rms_from_int16(pcm, _BANDPASS_SOS))
+
+# Compile (or load from the on-disk cache) the kernel at import so the first
+# control cycle does not stall on JIT compilation
+_filter_rms_from_int16(np.zeros(64, dtype=np.int16), _BANDPASS_SOS)
 
 # ---------------------- Interactive Calibration ----------------------
 
 def prompt_float(prompt_str, default_val):
+    prompt_with_default = f"{prompt_str} [{default_val}]: "
     while True:
-        user_input = input(f"{prompt_str} [{default_val}]: ").strip()
-        if user_input == "":
+        sys.stdout.write(prompt_with_default)
+        sys.stdout.flush()
+        user_input = sys.stdin.readline().strip()
+        if user_input == "":  # empty answer, or EOF
             return default_val
         try:
             return float(user_input)
@@ -194,9 +313,16 @@ def persist_calibration_to_script(script_path, proposal):
         "MIN_GAIN_DB":          f"{int(round(proposal['min_gain_db']))}",
         "MAX_GAIN_DB":          f"{int(round(proposal['max_gain_db']))}"
     }
+    with open(script_path, "r", encoding="utf-8") as f:
+        src = f.read()
     for var, val in subs.items():
-        cmd = f"sed -i 's|^{var} = .*|{var} = {val}|' \"{script_path}\""
-        os.system(cmd)
+        src = re.sub(rf"(?m)^{re.escape(var)}\s*=.*$", f"{var} = {val}", src)
+    # Write next to the script and swap it in, keeping the executable bit
+    tmp_path = script_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(src)
+    shutil.copymode(script_path, tmp_path)
+    os.replace(tmp_path, script_path)
     print("✅ Script has been updated with the new calibration values.\n")
 
 # ---------------------- Test Mode: Real-Time RMS Graph using plotext ----------------------
@@ -210,48 +336,53 @@ def test_mode():
 
     print("\n-- TEST MODE: Real-Time RMS Line Graph (plotext) --")
     print("Recording 5-second samples in a loop. Press Ctrl+C to exit.\n")
-    rms_history = []
-    iterations = []
     max_points = 20
+    rms_history = deque(maxlen=max_points)
+    iterations = deque(maxlen=max_points)
+    redraw_every = 5  # full graph redraws; status changes also trigger one
+    last_status = None
     i = 0
+    nbytes = SAMPLING_RATE * CAPTURE_SECONDS * 2
+    proc = start_ffmpeg(RTSP_URL)
 
-    while True:
-        audio = capture_audio(RTSP_URL, duration=5)
-        if audio is None or len(audio) == 0:
-            print("No audio captured, retrying...")
-            time.sleep(5)
-            continue
-
-        filtered = bandpass_filter(audio, LOWCUT, HIGHCUT, SAMPLING_RATE, FILTER_ORDER)
-        rms = measure_rms(filtered)
-
-        rms_history.append(rms)
-        iterations.append(i)
-        i += 1
-
-        if len(rms_history) > max_points:
-            rms_history = rms_history[-max_points:]
-            iterations = iterations[-max_points:]
-
-        if rms > NOISE_THRESHOLD_HIGH:
-            status = "🔴 ABOVE"
-        elif rms < NOISE_THRESHOLD_LOW:
-            status = "🔵 BELOW"
-        else:
-            status = "🟢 OK"
-
-        plt.clf()
-        plt.plot(iterations, rms_history, marker="dot", color="cyan")
-        plt.horizontal_line(NOISE_THRESHOLD_HIGH, color="red")
-        plt.horizontal_line(NOISE_THRESHOLD_LOW, color="blue")
-        plt.title("Real-Time RMS (Line Graph)")
-        plt.xlabel("Iteration")
-        plt.ylabel("RMS")
-        plt.ylim(0, max(0.001, max(rms_history) * 1.2))
-        plt.show()
-
-        print(f"Current RMS: {rms:.6f} — {status}")
-        time.sleep(0.5)
+    try:
+        while True:
+            pcm = read_chunk(proc, nbytes) if proc is not None else None
+            if pcm is None:
+                print("No audio captured, restarting ffmpeg...")
+                stop_ffmpeg(proc)
+                time.sleep(5)
+                proc = start_ffmpeg(RTSP_URL)
+                continue
+
+            rms = measure_band_rms(pcm)
+
+            rms_history.append(rms)
+            iterations.append(i)
+
+            if rms > NOISE_THRESHOLD_HIGH:
+                status = "🔴 ABOVE"
+            elif rms < NOISE_THRESHOLD_LOW:
+                status = "🔵 BELOW"
+            else:
+                status = "🟢 OK"
+
+            if i % redraw_every == 0 or status != last_status:
+                plt.clf()
+                plt.plot(list(iterations), list(rms_history), marker="dot", color="cyan")
+                plt.horizontal_line(NOISE_THRESHOLD_HIGH, color="red")
+                plt.horizontal_line(NOISE_THRESHOLD_LOW, color="blue")
+                plt.title("Real-Time RMS (Line Graph)")
+                plt.xlabel("Iteration")
+                plt.ylabel("RMS")
+                plt.ylim(0, max(0.001, max(rms_history) * 1.2))
+                plt.show()
+            last_status = status
+            i += 1
+
+            print(f"Current RMS: {rms:.6f} — {status}")
+    finally:
+        stop_ffmpeg(proc)
 
 # ---------------------- Dynamic Gain Control Loop ----------------------
 
@@ -260,40 +391,56 @@ def dynamic_gain_control():
     set_gain_db(MICROPHONE_NAME, (MIN_GAIN_DB + MAX_GAIN_DB) // 2)
 
     no_signal_count = 0
+    cycle = 0
+    # Blocking on SLEEP_SECONDS of audio is the loop's pacing; the stream stays open
+    nbytes = SAMPLING_RATE * SLEEP_SECONDS * 2
+    proc = start_ffmpeg(RTSP_URL)
 
-    while True:
-        audio = capture_audio(RTSP_URL)
-        if audio is None or len(audio) == 0:
-            debug_print("No audio captured; retrying...", "warning")
-            time.sleep(SLEEP_SECONDS)
-            continue
-
-        filtered = bandpass_filter(audio, LOWCUT, HIGHCUT, SAMPLING_RATE, FILTER_ORDER)
-        rms = measure_rms(filtered)
-        debug_print(f"Measured RMS: {rms:.6f}", "info")
-
-        # No-signal detection
-        if rms < NO_SIGNAL_THRESHOLD:
-            no_signal_count += 1
-            debug_print(f"No signal detected ({no_signal_count}/{NO_SIGNAL_COUNT_THRESHOLD})", "warning")
-            if no_signal_count >= NO_SIGNAL_COUNT_THRESHOLD:
-                debug_print("No signal for too long, executing action...", "error")
-                subprocess.call(NO_SIGNAL_ACTION, shell=True)
-        else:
-            no_signal_count = 0
-
-        current_gain = get_gain_db(MICROPHONE_NAME)
-        if current_gain is None:
-            debug_print("Failed to read current gain; skipping cycle.", "warning")
-            time.sleep(SLEEP_SECONDS)
-            continue
-
-        if rms > NOISE_THRESHOLD_HIGH:
-            set_gain_db(MICROPHONE_NAME, current_gain - GAIN_STEP_DB)
-        elif rms < NOISE_THRESHOLD_LOW:
-            set_gain_db(MICROPHONE_NAME, current_gain + GAIN_STEP_DB)
-
-        time.sleep(SLEEP_SECONDS)
+    try:
+        while True:
+            pcm = read_chunk(proc, nbytes) if proc is not None else None
+            if pcm is None:
+                debug_print("No audio captured; restarting ffmpeg...", "warning")
+                stop_ffmpeg(proc)
+                time.sleep(SLEEP_SECONDS)
+                proc = start_ffmpeg(RTSP_URL)
+                continue
+
+            # A silent buffer cannot have any filtered energy: skip the filter pass.
+            # max/min instead of np.abs, which would overflow on -32768
+            peak = max(int(pcm.max()), -int(pcm.min())) / 32768.0
+            if peak < NO_SIGNAL_THRESHOLD:
+                rms = 0.0
+            else:
+                rms = measure_band_rms(pcm)
+            debug_print(f"Measured RMS: {rms:.6f}", "info")
+
+            # No-signal detection
+            if rms < NO_SIGNAL_THRESHOLD:
+                no_signal_count += 1
+                debug_print(f"No signal detected ({no_signal_count}/{NO_SIGNAL_COUNT_THRESHOLD})", "warning")
+                if no_signal_count >= NO_SIGNAL_COUNT_THRESHOLD:
+                    debug_print("No signal for too long, executing action...", "error")
+                    subprocess.call(NO_SIGNAL_ACTION, shell=True)
+            else:
+                no_signal_count = 0
+
+            # Trust the value we last wrote; only ask amixer after a failure or
+            # every GAIN_RESYNC_CYCLES cycles in case something else changed it
+            cycle += 1
+            current_gain = _current_gain_db
+            if current_gain is None or cycle % GAIN_RESYNC_CYCLES == 0:
+                current_gain = refresh_gain_db(MICROPHONE_NAME)
+            if current_gain is None:
+                debug_print("Failed to read current gain; skipping cycle.", "warning")
+                continue
+
+            if rms > NOISE_THRESHOLD_HIGH:
+                set_gain_db(MICROPHONE_NAME, current_gain - GAIN_STEP_DB)
+            elif rms < NOISE_THRESHOLD_LOW:
+                set_gain_db(MICROPHONE_NAME, current_gain + GAIN_STEP_DB)
+    finally:
+        stop_ffmpeg(proc)
 
 # ---------------------- Main ----------------------
 